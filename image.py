@@ -7,73 +7,195 @@
 
 # Import packages
 import cv2
-import matplotlib.pyplot as plt
 import cvlib as cv
 from cvlib.object_detection import draw_bbox
+from cvlib import gender_detection, object_detection
 import imutils
 import numpy as np
+import mmap
+import os
+import sys
 
-# Read in a test image
-image = cv2.imread('/Users/andrew/GitHub/image_detection/getting-ready-for-the-speaker-series.jpg')
+# Longest side, in pixels, of images passed to the detectors.
+# The face and object models resize their input to 300x300 and 416x416 anyway.
+MAX_IMAGE_SIZE = 1280
 
-# Show image. 
-plt.imshow(image)
+# File types picked up when a folder of images is passed in.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
 
-### Step 1. Detect gender in faces in image.
+def load_image(path):
+    
+    # Read in an image and downscale it once if it is larger than MAX_IMAGE_SIZE.
+    # Decode straight from a memory map of the file, so it is not first copied into a separate buffer.
+    with open(path, 'rb') as f:
 
-# Apply face detection
-faces, conf = cv.detect_face(image)
+        # An empty file cannot be memory mapped, and holds no image anyway.
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"cannot decode {path}")
 
-# Add a bounding box on faces.
-for face in faces:
-    (startX,startY) = face[0], face[1]
-    (endX, endY) = face[2], face[3]
-    
-    # Draw rectangle over faces.
-    cv2.rectangle(image, (startX,startY), (endX,endY), (0,255,0), 2)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            buf = np.frombuffer(data, dtype=np.uint8)
+            try:
+                image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+            except cv2.error:
+                image = None
+            finally:
 
-# Loop through detected faces, detect gender.
-for face in faces:
+                # Release the view before the memory map is closed, even if decoding failed.
+                del buf
+
+    if image is None:
+        raise ValueError(f"cannot decode {path}")
+
+    scale = MAX_IMAGE_SIZE / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    return image
+
+def crop_face(image, face):
     
-    # Store starting and ending X,Y coordinates for detected faces.
+    # Crop a detected face and resize it to the gender model's 96x96 input.
     (startX,startY) = face[0], face[1]
     (endX, endY) = face[2], face[3]
-    
-    # Crop detected faces.
-    face_crop = np.copy(image[startY:endY, startX:endX])
 
-    # Apply gender detection on cropped faces.
-    (label, confidence) = cv.detect_gender(face_crop)
+    return cv2.resize(image[startY:endY, startX:endX], (96,96))
+
+### Step 0. Load models.
+
+# cvlib loads each model on its first call and keeps it for later calls, so run every detector once on a blank image up front.
+blank_image = np.zeros((96,96,3), dtype=np.uint8)
+cv.detect_face(blank_image)
+cv.detect_gender(blank_image)
+cv.detect_common_objects(blank_image)
+
+# Run the YOLO object detector in half precision on the GPU when OpenCV is built with CUDA.
+if hasattr(cv2.dnn, 'DNN_BACKEND_CUDA') and cv2.cuda.getCudaEnabledDeviceCount() > 0:
+    object_detection.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+    object_detection.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA_FP16)
+
+    # Run YOLO once more so the CUDA setup also happens before the real images.
+    cv.detect_common_objects(blank_image)
+
+### Step 1. Detect gender in faces in image.
+
+# Labels of cvlib's gender model, in output order.
+gender_labels = np.array(['man', 'woman'])
+
+def detect_faces_and_gender(image, draw=True):
+
+    # Apply face detection
+    faces, conf = cv.detect_face(image)
 
-    # Choose most confident label.
-    ids = np.argmax(confidence)
-    label = label[ids]
+    # Clip detected faces to the image, since the detector can return boxes past its edges.
+    # Drop faces left with no area, so the crops and the drawn labels use the same faces.
+    (h, w) = image.shape[:2]
+    faces = np.clip(np.asarray(faces, dtype=int).reshape(-1, 4), 0, [w, h, w, h])
+    faces = faces[(faces[:, 2] > faces[:, 0]) & (faces[:, 3] > faces[:, 1])]
 
-    # Format label.
-    label = "{}: {:.2f}%".format(label, confidence[ids] * 100)
+    # Crop and resize detected faces.
+    face_crops = [crop_face(image, face) for face in faces]
 
-    # Set label placement.
-    Y = startY - 10 if startY - 10 > 10 else startY + 10
+    # Apply gender detection on all cropped faces in a single batch.
+    face_labels, face_scores = [], []
+    if face_crops:
+        batch = np.stack(face_crops).astype("float32") / 255.0
+        confidences = gender_detection.model.predict(batch)
 
-    # Push labels into image.
-    cv2.putText(image, label, (startX, Y), cv2.FONT_HERSHEY_DUPLEX, 1.1, (0, 0, 0), 2)
+        # Choose most confident label for all faces at once.
+        ids = confidences.argmax(axis=1)
+        face_labels = gender_labels[ids]
+        face_scores = confidences[np.arange(len(ids)), ids] * 100
 
-# Show results of face and gender detection, with confidence scores.          
-plt.imshow(image)
+    # Format labels.
+    labels = ["{}: {:.2f}%".format(label, score) for label, score in zip(face_labels, face_scores)]
+
+    if draw:
+
+        # Set label placement for all faces at once.
+        # Labels go above the box, or inside it when the face is near the top edge of the image.
+        face_tops = faces[:, 1]
+        label_ys = np.where(face_tops - 10 > 10, face_tops - 10, face_tops + 10)
+
+        # Loop through detected faces, draw bounding boxes and gender labels.
+        for face, label, Y in zip(faces, labels, label_ys):
+            
+            # Store starting and ending X,Y coordinates for detected faces.
+            (startX,startY) = face[0], face[1]
+            (endX, endY) = face[2], face[3]
+
+            # Draw rectangle over faces.
+            cv2.rectangle(image, (startX,startY), (endX,endY), (0,255,0), 2)
+
+            # Push labels into image.
+            cv2.putText(image, label, (startX, Y), cv2.FONT_HERSHEY_DUPLEX, 1.1, (0, 0, 0), 2)
+
+    # Return the gender labels, with confidence scores.
+    return labels
 
 ### Step 2. Detect other common objects in image, including people. 
 
-# Read in a test image
-image = cv2.imread('/Users/andrew/GitHub/image_detection/getting-ready-for-the-speaker-series.jpg')
+def detect_objects(image, draw=True):
+
+    # Dectect common objects in image. 
+    bbox, label, conf = cv.detect_common_objects(image)
+
+    # Draw boxes on objects. draw_bbox draws in place on the image.
+    if draw:
+        draw_bbox(image, bbox, label, conf)
+
+    # Return vector of labels assigned to the objects.
+    return label
+
+### Step 3. Run detection on a single image, or on every image in a folder.
+
+# Image or folder of images to run on, defaulting to the test image.
+image_path = sys.argv[1] if len(sys.argv) > 1 else '/Users/andrew/GitHub/image_detection/getting-ready-for-the-speaker-series.jpg'
+
+if os.path.isdir(image_path):
+
+    # Batch mode: reuse the models loaded in Step 0 for every image and print results instead of showing them.
+    # Images are processed one at a time, since cvlib shares a single network per model across calls.
+    for file_name in sorted(os.listdir(image_path)):
+        file_path = os.path.join(image_path, file_name)
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(file_path):
+            continue
+
+        # Skip files that cannot be read or run through the detectors, rather than stopping the whole run.
+        # Nothing is drawn, so both detectors can share the same image.
+        try:
+            image = load_image(file_path)
+            face_labels = detect_faces_and_gender(image, draw=False)
+            object_labels = detect_objects(image, draw=False)
+        except (OSError, ValueError, cv2.error) as error:
+            print(file_name + ' skipped: ' + str(error), file=sys.stderr)
+            continue
+
+        print(file_name + ' faces found:' + str(face_labels))
+        print(file_name + ' objects found:' + str(object_labels))
+
+else:
+
+    # Read in a test image
+    image = load_image(image_path)
+
+    # Keep an unannotated copy for object detection, instead of reading the image in again.
+    objects_image = image.copy()
+
+    # Show image. OpenCV windows take the BGR image directly, no colorspace conversion or figure rendering.
+    cv2.imshow('Input image', image)
 
-# Dectect common objects in image. 
-bbox, label, conf = cv.detect_common_objects(image)
+    # Show results of face and gender detection, with confidence scores.
+    detect_faces_and_gender(image)
+    cv2.imshow('Faces and gender', image)
 
-# Draw boxes on objects. 
-output_image = draw_bbox(image, bbox, label, conf)
+    # Show boxes on objects.
+    label = detect_objects(objects_image)
+    cv2.imshow('Common objects', objects_image)
 
-# Show boxes on object. 
-plt.imshow(output_image)
+    # Print vector of labels assigned to the object.
+    print('Objects found:' + str(label))
 
-# Print vector of labels assigned to the object.
-print('Objects found:' + str(label))
\ No newline at end of file
+    # Keep result windows open until a key is pressed.
+    cv2.waitKey(0)
+    cv2.destroyAllWindows()